@@ -5,17 +5,17 @@ Main application with scheduler and health checks
 
 import os
 import logging
+import uuid
 from flask import Flask, jsonify
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
 
 # Import analysis modules
-from src.data_collector import CoinGeckoDataAgent
-from src.technical_analyzer import TechnicalAnalyzer
-from src.scoring_selector import ScoringSelector
+from src.pipeline import run_crypto_analysis, load_last_run
 from src.telegram_notifier import TelegramNotifier
 
 # Configure logging
@@ -28,93 +28,49 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
-# Global variables for status tracking
-last_run = {"time": None, "status": "Never run", "signals": 0}
-
-
-def run_crypto_analysis():
-    """Execute the complete crypto analysis pipeline"""
-    global last_run
-    
-    try:
-        logger.info("🚀 Starting Crypto Analysis Pipeline")
-        start_time = datetime.now()
-        
-        # Agent 1: Data Collection
-        data_agent = CoinGeckoDataAgent(top_n=100)
-        crypto_data = data_agent.collect_data()
-        
-        if not crypto_data['coins']:
-            logger.error("No coin data collected")
-            last_run = {
-                "time": start_time.isoformat(),
-                "status": "Failed - No data",
-                "signals": 0
-            }
+# In-process job queue for manual triggers: /analyze enqueues and returns a
+# job id immediately; the single worker drains jobs one at a time so parallel
+# triggers can't stack up pipeline runs. Process-local state — the web service
+# must run with a single gunicorn worker (see render.yaml).
+job_executor = ThreadPoolExecutor(max_workers=1)
+jobs = {}
+
+
+def enqueue_analysis() -> str:
+    """Queue one analysis run and return its job id"""
+    job_id = uuid.uuid4().hex[:12]
+    jobs[job_id] = {"status": "queued", "enqueued_at": datetime.now().isoformat()}
+
+    def _run():
+        jobs[job_id]["status"] = "running"
+        try:
+            result = run_crypto_analysis()
+        except Exception as e:
+            jobs[job_id]["status"] = "failed"
+            jobs[job_id]["error"] = str(e)
             return
-        
-        # Agent 2: Technical Analysis
-        analyzer = TechnicalAnalyzer()
-        technical_data = analyzer.analyze_all(crypto_data)
-        
-        if not technical_data['analyzed_coins']:
-            logger.error("No coins analyzed")
-            last_run = {
-                "time": start_time.isoformat(),
-                "status": "Failed - Analysis error",
-                "signals": 0
-            }
-            return
-        
-        # Agent 3: Scoring & Selection
-        selector = ScoringSelector()
-        top_signals = selector.select_top_opportunities(technical_data)
-        
-        # Agent 4: Send Notifications
-        telegram = TelegramNotifier()
-        
-        # Load data for reporting
-        import json
-        with open('data/selected_cryptos.json', 'r') as f:
-            data = json.load(f)
-        
-        telegram.send_analysis_report(data)
-        
-        # Send high-score alerts
-        for signal in top_signals:
-            telegram.send_high_score_alert(signal)
-        
-        # Update status
-        duration = (datetime.now() - start_time).total_seconds()
-        last_run = {
-            "time": start_time.isoformat(),
-            "status": "Success",
-            "signals": len(top_signals),
-            "duration_seconds": round(duration, 2)
-        }
-        
-        logger.info(f"✅ Analysis complete! {len(top_signals)} signals found in {duration:.1f}s")
-        
-    except Exception as e:
-        logger.error(f"❌ Error in analysis pipeline: {e}", exc_info=True)
-        last_run = {
-            "time": datetime.now().isoformat(),
-            "status": f"Failed - {str(e)}",
-            "signals": 0
-        }
+        # run_crypto_analysis reports pipeline failures in its return value
+        jobs[job_id]["status"] = "finished" if result.get("status") == "Success" else "failed"
+        jobs[job_id]["result"] = result.get("status")
+
+    job_executor.submit(_run)
+    return job_id
 
 
 # Initialize scheduler
 scheduler = BackgroundScheduler(timezone=pytz.timezone('Europe/Madrid'))
 
 # Schedule jobs: # Todos los días a las 9:30 AM CET
-scheduler.add_job(
-    func=run_crypto_analysis,
-    trigger=CronTrigger(hour=9, minute=30, timezone='Europe/Madrid'),
-    id='daily_analysis',
-    name='Daily Crypto Analysis',
-    replace_existing=True
-)
+# With the dedicated worker service (worker.py) deployed, set RUN_SCHEDULER=0
+# so the web process only serves requests and the keep-alive ping.
+if os.environ.get('RUN_SCHEDULER', '1') == '1':
+    scheduler.add_job(
+        func=run_crypto_analysis,
+        trigger=CronTrigger(hour=9, minute=30, timezone='Europe/Madrid'),
+        id='daily_analysis',
+        name='Daily Crypto Analysis',
+        replace_existing=True
+    )
 
 # Keep-alive ping cada 10 minutos para evitar que Render pause el servicio
 scheduler.add_job(
@@ -162,9 +118,13 @@ def health():
 
 @app.route('/status')
 def status():
-    """Get status of last analysis run"""
+    """Get status of the last analysis run recorded by this process's host.
+
+    In the two-service deploy (see render.yaml) this covers manual runs
+    only; the worker's scheduled runs land on its own disk.
+    """
     return jsonify({
-        "last_run": last_run,
+        "last_run": load_last_run(),
         "scheduled_jobs": [
             {
                 "id": job.id,
@@ -180,17 +140,12 @@ def status():
 def analyze():
     """Manually trigger analysis"""
     try:
-        # Run analysis in background
-        scheduler.add_job(
-            func=run_crypto_analysis,
-            trigger='date',
-            id='manual_trigger',
-            name='Manual Analysis',
-            replace_existing=True
-        )
+        # Enqueue and return immediately; the worker thread runs the pipeline
+        job_id = enqueue_analysis()
         return jsonify({
             "status": "Analysis triggered",
-            "message": "Analysis started in background. Check /status for results."
+            "job_id": job_id,
+            "message": f"Analysis queued. Check /status/{job_id} for progress."
         }), 202
     except Exception as e:
         logger.error(f"Error triggering analysis: {e}")
@@ -200,6 +155,15 @@ def analyze():
         }), 500
 
 
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    """Get status of a manually triggered analysis job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job id"}), 404
+    return jsonify({"job_id": job_id, **job})
+
+
 @app.route('/test')
 def test_telegram():
     """Test Telegram connection"""
@@ -3,18 +3,37 @@ Data Collection Agent - CoinGecko API
 """
 
 import os
-import json
 import logging
+import pickle
 import time
+import asyncio
 from datetime import datetime
 from typing import Dict, List
+import aiohttp
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 
+from src.json_utils import dump_json
+
 logger = logging.getLogger(__name__)
 
 REQUEST_DELAY = 6.0  # Seconds between API calls (increased for rate limit)
 
+# Async fetch tuning: stay under CoinGecko's ~30 requests/min free tier.
+# Each of the N semaphore slots must hold for N times the aggregate
+# per-request interval, otherwise the slots together emit N requests per
+# interval and overshoot the budget N-fold.
+MAX_CONCURRENT_REQUESTS = 8
+RATE_LIMIT_INTERVAL = 60 / 29  # Aggregate seconds per request across all slots
+SLOT_HOLD_SECONDS = MAX_CONCURRENT_REQUESTS * RATE_LIMIT_INTERVAL
+
+SPARKLINE_CANDLE_HOURS = 4  # Synthetic candle width built from hourly sparkline prices
+
+MARKET_CONTEXT_TTL = 300  # Seconds before the /global response is revalidated
+
 # Headers to avoid rate limiting
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -26,11 +45,28 @@ class CoinGeckoDataAgent:
     """Agent 1: Data collection from CoinGecko API"""
     
     BASE_URL = "https://api.coingecko.com/api/v3"
-    
+
+    # Stablecoins and wrapped tokens excluded from analysis
+    EXCLUDED = frozenset((
+        'USDT', 'USDC', 'DAI', 'BUSD', 'USDS', 'USDE',
+        'PYUSD', 'TUSD', 'FDUSD', 'USDT0', 'BSC-USD'
+    ))
+
     def __init__(self, top_n: int = 100):
         self.top_n = top_n
         self.cache_file = "data/crypto_data.json"
-        
+        self.ohlc_cache_file = "data/ohlc_cache.npz"
+        self.market_context_cache = "data/market_context.pkl"
+        # One keep-alive session for the sync endpoints; urllib3 handles
+        # retries with backoff on 429/5xx so callers don't hand-roll loops
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=Retry(total=3, backoff_factor=2,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        ))
+
     def fetch_top_coins(self) -> List[Dict]:
         """Fetch top cryptocurrencies by market cap"""
         logger.info(f"Fetching top {self.top_n} cryptocurrencies...")
@@ -41,12 +77,12 @@ class CoinGeckoDataAgent:
             "order": "market_cap_desc",
             "per_page": self.top_n,
             "page": 1,
-            "sparkline": False,
+            "sparkline": True,
             "price_change_percentage": "24h,7d"
         }
         
         try:
-            response = requests.get(url, params=params, headers=HEADERS, timeout=30)
+            response = self.session.get(url, params=params, headers=HEADERS, timeout=30)
             response.raise_for_status()
             coins = response.json()
             logger.info(f"✓ Fetched {len(coins)} coins")
@@ -55,64 +91,172 @@ class CoinGeckoDataAgent:
             logger.error(f"Error fetching coins: {e}")
             return []
     
-    def fetch_ohlc_with_retry(self, coin_id: str, days: int = 30, max_retries: int = 3) -> pd.DataFrame:
-        """Fetch OHLC data with retry logic"""
+    async def fetch_ohlc_async(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                               coin_id: str, days: int = 30, max_retries: int = 3) -> pd.DataFrame:
+        """Fetch OHLC data for one coin, rate-limited by the shared semaphore"""
         url = f"{self.BASE_URL}/coins/{coin_id}/ohlc"
         params = {"vs_currency": "usd", "days": days}
-        
+
         for attempt in range(max_retries):
             try:
-                time.sleep(REQUEST_DELAY)
-                response = requests.get(url, params=params, headers=HEADERS, timeout=30)
-                
-                if response.status_code == 429:
-                    wait_time = REQUEST_DELAY * (attempt + 2)
-                    logger.warning(f"Rate limited for {coin_id}, waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                
-                response.raise_for_status()
-                data = response.json()
-                
+                async with sem:
+                    async with session.get(url, params=params, headers=HEADERS) as response:
+                        if response.status == 429:
+                            wait_time = float(response.headers.get('Retry-After', REQUEST_DELAY * (attempt + 2)))
+                            logger.warning(f"Rate limited for {coin_id}, waiting {wait_time}s...")
+                            await asyncio.sleep(wait_time)
+                            continue
+
+                        response.raise_for_status()
+                        data = await response.json()
+                    # Hold the rate slot so total throughput stays under the API limit
+                    await asyncio.sleep(SLOT_HOLD_SECONDS)
+
                 if not data:
                     return pd.DataFrame()
-                
+
                 df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close'])
                 df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
                 return df
-                
-            except requests.exceptions.HTTPError as e:
-                if "429" in str(e):
-                    wait_time = REQUEST_DELAY * (attempt + 2)
-                    time.sleep(wait_time)
-                    continue
-                logger.error(f"Error fetching OHLC for {coin_id}: {e}")
-                return pd.DataFrame()
+
             except Exception as e:
                 logger.error(f"Error fetching OHLC for {coin_id}: {e}")
                 return pd.DataFrame()
-        
+
         return pd.DataFrame()
-    
+
+    async def _fetch_all_ohlc(self, coin_ids: List[str], days: int = 30) -> Dict[str, pd.DataFrame]:
+        """Fetch OHLC for all coins concurrently"""
+        sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+        timeout = aiohttp.ClientTimeout(total=30)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [self.fetch_ohlc_async(session, sem, coin_id, days) for coin_id in coin_ids]
+            results = await asyncio.gather(*tasks)
+
+        return dict(zip(coin_ids, results))
+
+    def _load_ohlc_cache(self) -> Dict[str, pd.DataFrame]:
+        """Load the per-day OHLC cache from its binary columnar snapshot"""
+        try:
+            npz = np.load(self.ohlc_cache_file, allow_pickle=False)
+        except (FileNotFoundError, ValueError, OSError):
+            return {}
+
+        with npz:
+            grouped = {}
+            for name in npz.files:
+                entry, col = name.rsplit('__', 1)
+                grouped.setdefault(entry, {})[col] = npz[name]
+
+            cache = {}
+            for entry, cols in grouped.items():
+                if set(cols) >= {'timestamp', 'open', 'high', 'low', 'close'}:
+                    cache[entry] = pd.DataFrame({
+                        'timestamp': pd.to_datetime(cols['timestamp'], unit='ms'),
+                        'open': cols['open'],
+                        'high': cols['high'],
+                        'low': cols['low'],
+                        'close': cols['close']
+                    })
+        return cache
+
+    def _save_ohlc_cache(self, cache: Dict[str, pd.DataFrame]):
+        os.makedirs('data', exist_ok=True)
+        columns = {}
+        for entry, df in cache.items():
+            columns[f"{entry}__timestamp"] = df['timestamp'].to_numpy().astype('datetime64[ms]').astype('int64')
+            for col in ('open', 'high', 'low', 'close'):
+                columns[f"{entry}__{col}"] = df[col].to_numpy()
+        np.savez(self.ohlc_cache_file, **columns)
+
+    def fetch_all_ohlc(self, coin_ids: List[str], days: int = 30) -> Dict[str, pd.DataFrame]:
+        """Concurrent OHLC fetch with a per-day cache so same-day reruns skip the network"""
+        day = datetime.now().strftime('%Y-%m-%d')
+        cache = {k: v for k, v in self._load_ohlc_cache().items() if k.endswith(day)}
+
+        results = {}
+        missing = []
+        for coin_id in coin_ids:
+            df = cache.get(f"{coin_id}:{day}")
+            if df is not None:
+                results[coin_id] = df
+            else:
+                missing.append(coin_id)
+
+        if missing:
+            logger.info(f"Fetching OHLC for {len(missing)} coins ({len(results)} cached)...")
+            fetched = asyncio.run(self._fetch_all_ohlc(missing, days))
+            for coin_id, df in fetched.items():
+                results[coin_id] = df
+                if not df.empty:
+                    cache[f"{coin_id}:{day}"] = df
+            self._save_ohlc_cache(cache)
+
+        return results
+
+    def build_ohlc_from_sparkline(self, coin: Dict) -> pd.DataFrame:
+        """Build synthetic OHLC candles from the hourly 7d sparkline in the markets payload"""
+        prices = (coin.get('sparkline_in_7d') or {}).get('price') or []
+        if len(prices) < 20 * SPARKLINE_CANDLE_HOURS:
+            return pd.DataFrame()
+
+        # Align chunks to the end so the last candle holds the newest prices
+        offset = len(prices) % SPARKLINE_CANDLE_HOURS
+        candles = []
+        for start in range(offset, len(prices), SPARKLINE_CANDLE_HOURS):
+            chunk = prices[start:start + SPARKLINE_CANDLE_HOURS]
+            candles.append((chunk[0], max(chunk), min(chunk), chunk[-1]))
+
+        df = pd.DataFrame(candles, columns=['open', 'high', 'low', 'close'])
+        df.insert(0, 'timestamp', pd.date_range(
+            end=datetime.now(), periods=len(candles), freq=f'{SPARKLINE_CANDLE_HOURS}h'
+        ))
+        return df
+
     def get_market_context(self) -> Dict:
-        """Get global market context"""
+        """Get global market context (cached for 5 minutes, revalidated via ETag)"""
+        cached = None
+        try:
+            with open(self.market_context_cache, 'rb') as f:
+                cached = pickle.load(f)
+            if time.time() - os.path.getmtime(self.market_context_cache) < MARKET_CONTEXT_TTL:
+                return cached['context']
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            cached = None
+
         url = f"{self.BASE_URL}/global"
-        
+        headers = dict(HEADERS)
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+
         try:
             time.sleep(REQUEST_DELAY)
-            response = requests.get(url, headers=HEADERS, timeout=30)
+            response = self.session.get(url, headers=headers, timeout=30)
+
+            if response.status_code == 304 and cached:
+                # Unchanged upstream — refresh the TTL window and reuse
+                os.utime(self.market_context_cache)
+                return cached['context']
+
             response.raise_for_status()
             data = response.json()['data']
-            
-            return {
+
+            context = {
                 "btc_dominance": data.get('market_cap_percentage', {}).get('btc', 0),
                 "total_market_cap": data.get('total_market_cap', {}).get('usd', 0),
                 "total_volume_24h": data.get('total_volume', {}).get('usd', 0),
                 "active_cryptocurrencies": data.get('active_cryptocurrencies', 0)
             }
+
+            os.makedirs('data', exist_ok=True)
+            with open(self.market_context_cache, 'wb') as f:
+                pickle.dump({'context': context, 'etag': response.headers.get('ETag')}, f)
+            return context
         except Exception as e:
             logger.error(f"Error fetching market context: {e}")
-            return {}
+            return cached['context'] if cached else {}
     
     def collect_data(self) -> Dict:
         """Main data collection pipeline"""
@@ -128,29 +272,44 @@ class CoinGeckoDataAgent:
         }
         
         # Filter out stablecoins and wrapped tokens
-        excluded = ['USDT', 'USDC', 'DAI', 'BUSD', 'USDS', 'USDE', 'PYUSD', 'TUSD', 'FDUSD', 'USDT0', 'BSC-USD']
-        
-        tradeable_coins = [c for c in coins if c['symbol'].upper() not in excluded]
+        tradeable_coins = [c for c in coins if c['symbol'].upper() not in self.EXCLUDED]
         coins_to_process = min(15, len(tradeable_coins))  # Reduced from 25 to 15
         
         logger.info(f"Processing {coins_to_process} tradeable coins...")
-        
-        for i, coin in enumerate(tradeable_coins[:coins_to_process]):
-            logger.info(f"Processing {coin['symbol'].upper()} ({i+1}/{coins_to_process})...")
-            
-            ohlc = self.fetch_ohlc_with_retry(coin['id'], days=30)
-            
+
+        selected_coins = tradeable_coins[:coins_to_process]
+
+        # Primary path: synthetic OHLC from the sparkline already in the markets payload
+        ohlc_by_coin = {c['id']: self.build_ohlc_from_sparkline(c) for c in selected_coins}
+
+        # Fallback: true OHLC (cached per day) for coins without a usable sparkline
+        missing = [cid for cid, df in ohlc_by_coin.items() if df.empty]
+        if missing:
+            ohlc_by_coin.update(self.fetch_all_ohlc(missing, days=30))
+
+        for coin in selected_coins:
+            ohlc = ohlc_by_coin.get(coin['id'], pd.DataFrame())
+
             if not ohlc.empty and len(ohlc) >= 20:
-                ohlc_list = []
-                for _, row in ohlc.iterrows():
-                    ohlc_list.append({
-                        "timestamp": row['timestamp'].isoformat(),
-                        "open": float(row['open']),
-                        "high": float(row['high']),
-                        "low": float(row['low']),
-                        "close": float(row['close'])
-                    })
-                
+                # Vectorized conversion — iterrows allocates a Series per row
+                ohlc = ohlc.astype({'open': float, 'high': float, 'low': float, 'close': float})
+
+                # Columnar (SoA) layout: one contiguous array per field, consumed
+                # directly by the analyzer without re-parsing the record dicts.
+                # float32 halves the footprint; well within indicator precision
+                # for 30-bar series
+                ohlc_arrays = {
+                    'ts': ohlc['timestamp'].to_numpy(),
+                    'open': ohlc['open'].to_numpy(dtype=np.float32),
+                    'high': ohlc['high'].to_numpy(dtype=np.float32),
+                    'low': ohlc['low'].to_numpy(dtype=np.float32),
+                    'close': ohlc['close'].to_numpy(dtype=np.float32)
+                }
+
+                ohlc['timestamp'] = ohlc['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+                ohlc_list = ohlc[['timestamp', 'open', 'high', 'low', 'close']].to_dict(orient='records')
+
+
                 coin_data = {
                     "id": coin['id'],
                     "symbol": coin['symbol'].upper(),
@@ -160,14 +319,30 @@ class CoinGeckoDataAgent:
                     "total_volume": float(coin['total_volume']) if coin['total_volume'] else 0,
                     "price_change_24h": float(coin.get('price_change_percentage_24h') or 0),
                     "price_change_7d": float(coin.get('price_change_percentage_7d_in_currency') or 0),
-                    "ohlc": ohlc_list
+                    "ohlc": ohlc_list,
+                    "ohlc_arrays": ohlc_arrays
                 }
                 crypto_data['coins'].append(coin_data)
                 logger.info(f"  ✓ {coin['symbol'].upper()} saved")
         
         os.makedirs('data', exist_ok=True)
-        with open(self.cache_file, 'w') as f:
-            json.dump(crypto_data, f, indent=2)
-        
+
+        # Binary columnar snapshot for fast reload
+        columns = {
+            f"{c['symbol']}__{key}": arr
+            for c in crypto_data['coins']
+            for key, arr in c['ohlc_arrays'].items()
+        }
+        if columns:
+            np.savez_compressed('data/ohlc.npz', **columns)
+
+        # JSON artifact keeps only the record lists — the arrays are redundant there
+        serializable = dict(crypto_data)
+        serializable['coins'] = [
+            {k: v for k, v in c.items() if k != 'ohlc_arrays'}
+            for c in crypto_data['coins']
+        ]
+        dump_json(serializable, self.cache_file)
+
         logger.info(f"✓ Data collection complete. {len(crypto_data['coins'])} coins saved.")
         return crypto_data
@@ -0,0 +1,53 @@
+"""
+JIT-compiled indicator kernels
+Uses numba when available, falls back to pure numpy/Python otherwise
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """No-op decorator so the kernels below still run without numba"""
+        if args and callable(args[0]):
+            return args[0]
+
+        def wrap(func):
+            return func
+        return wrap
+
+
+@njit(cache=True, fastmath=True)
+def ema_1d(prices: np.ndarray, period: int) -> np.ndarray:
+    """EMA recurrence over a single price series"""
+    alpha = 2.0 / (period + 1)
+    ema = np.empty_like(prices)
+    ema[0] = prices[0]
+    for t in range(1, prices.shape[0]):
+        ema[t] = alpha * prices[t] + (1.0 - alpha) * ema[t - 1]
+    return ema
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def ema_batch(closes: np.ndarray, period: int) -> np.ndarray:
+    """EMA recurrence over a (n_coins, n_candles) matrix, parallel over coins"""
+    alpha = 2.0 / (period + 1)
+    ema = np.empty_like(closes)
+    for i in prange(closes.shape[0]):
+        ema[i, 0] = closes[i, 0]
+        for t in range(1, closes.shape[1]):
+            ema[i, t] = alpha * closes[i, t] + (1.0 - alpha) * ema[i, t - 1]
+    return ema
+
+
+# Warm the JIT cache at import time so the first scheduled run doesn't pay
+# compile cost; float32 is the dtype the pipeline feeds in production
+if NUMBA_AVAILABLE:
+    _warmup = np.zeros((2, 4), dtype=np.float32)
+    ema_1d(_warmup[0], 7)
+    ema_batch(_warmup, 7)
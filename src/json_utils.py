@@ -0,0 +1,40 @@
+"""
+JSON helpers shared by the pipeline agents
+Uses orjson when available (Rust-backed, much faster dumps), stdlib json otherwise
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_json(data, path: str, indent: bool = True):
+    """Write data as JSON to path"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=option))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2 if indent else None)
+
+
+def dumps_bytes(data) -> bytes:
+    """Serialize data to compact JSON bytes (e.g. for HTTP request bodies)"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def load_json(path: str):
+    """Read JSON from path"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
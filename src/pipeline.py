@@ -0,0 +1,117 @@
+"""
+Analysis Pipeline
+Runs the four agents end to end; shared by the web app and the scheduler worker
+"""
+
+import os
+import logging
+from datetime import datetime
+from typing import Dict
+
+from src.data_collector import CoinGeckoDataAgent
+from src.technical_analyzer import TechnicalAnalyzer
+from src.scoring_selector import ScoringSelector
+from src.telegram_notifier import TelegramNotifier
+from src.json_utils import dump_json, load_json
+
+logger = logging.getLogger(__name__)
+
+LAST_RUN_FILE = "data/last_run.json"
+
+
+def save_last_run(status: Dict):
+    os.makedirs('data', exist_ok=True)
+    dump_json(status, LAST_RUN_FILE)
+
+
+def load_last_run() -> Dict:
+    """Read the status of the last run recorded on this host.
+
+    The file is only visible to processes sharing a filesystem. In the
+    two-service Render deploy (web + worker.py) each service has its own
+    ephemeral disk, so the web /status endpoint reflects manual runs
+    triggered through the web process, not the worker's scheduled runs.
+    """
+    try:
+        return load_json(LAST_RUN_FILE)
+    except (FileNotFoundError, ValueError):
+        return {"time": None, "status": "Never run", "signals": 0}
+
+
+def run_crypto_analysis() -> Dict:
+    """Execute the complete crypto analysis pipeline"""
+    try:
+        logger.info("🚀 Starting Crypto Analysis Pipeline")
+        start_time = datetime.now()
+
+        # Agent 1: Data Collection
+        data_agent = CoinGeckoDataAgent(top_n=100)
+        crypto_data = data_agent.collect_data()
+
+        if not crypto_data['coins']:
+            logger.error("No coin data collected")
+            last_run = {
+                "time": start_time.isoformat(),
+                "status": "Failed - No data",
+                "signals": 0
+            }
+            save_last_run(last_run)
+            return last_run
+
+        # Agent 2: Technical Analysis
+        analyzer = TechnicalAnalyzer()
+        technical_data = analyzer.analyze_all(crypto_data)
+
+        if not technical_data['analyzed_coins']:
+            logger.error("No coins analyzed")
+            last_run = {
+                "time": start_time.isoformat(),
+                "status": "Failed - Analysis error",
+                "signals": 0
+            }
+            save_last_run(last_run)
+            return last_run
+
+        # Agent 3: Scoring & Selection
+        selector = ScoringSelector()
+        top_signals, report = selector.select_top_opportunities(technical_data)
+
+        # Agent 4: Send Notifications
+        telegram = TelegramNotifier()
+        telegram.send_analysis_report(report)
+
+        # Alerts are queued to the notifier's background thread; flush so the
+        # run isn't recorded (or the process gone) with alerts still pending
+        high_score = TelegramNotifier.filter_high_score(top_signals)
+        if high_score:
+            for signal in high_score:
+                telegram.send_high_score_alert(signal)
+            telegram.flush()
+
+        # One notifier per run: stop its alert worker and release the
+        # connection pool, or the long-lived scheduler process leaks a
+        # thread (and its pinned session) every alert-bearing run
+        telegram.close()
+
+        # Update status
+        duration = (datetime.now() - start_time).total_seconds()
+        last_run = {
+            "time": start_time.isoformat(),
+            "status": "Success",
+            "signals": len(top_signals),
+            "duration_seconds": round(duration, 2)
+        }
+        save_last_run(last_run)
+
+        logger.info(f"✅ Analysis complete! {len(top_signals)} signals found in {duration:.1f}s")
+        return last_run
+
+    except Exception as e:
+        logger.error(f"❌ Error in analysis pipeline: {e}", exc_info=True)
+        last_run = {
+            "time": datetime.now().isoformat(),
+            "status": f"Failed - {str(e)}",
+            "signals": 0
+        }
+        save_last_run(last_run)
+        return last_run
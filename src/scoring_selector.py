@@ -4,11 +4,13 @@ Scores coins and selects top opportunities
 """
 
 import os
-import json
 import logging
 from datetime import datetime
 from typing import Dict, List
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
+import numpy as np
+
+from src.json_utils import dump_json
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +38,27 @@ class CryptoSignal:
     timestamp: str
     
     def to_dict(self):
-        return asdict(self)
+        # Shallow dict literal — asdict() deep-copies every field recursively
+        return {
+            "symbol": self.symbol,
+            "name": self.name,
+            "pair": self.pair,
+            "price": self.price,
+            "market_cap": self.market_cap,
+            "volume_24h": self.volume_24h,
+            "technical_score": self.technical_score,
+            "momentum_score": self.momentum_score,
+            "volume_score": self.volume_score,
+            "risk_score": self.risk_score,
+            "final_score": self.final_score,
+            "signals": self.signals,
+            "entry_zone": self.entry_zone,
+            "stop_loss": self.stop_loss,
+            "target_1": self.target_1,
+            "target_2": self.target_2,
+            "btc_correlation": self.btc_correlation,
+            "timestamp": self.timestamp
+        }
 
 
 class ScoringSelector:
@@ -57,52 +79,56 @@ class ScoringSelector:
             return 0.95
         return 0.0
     
+    def score_all(self, analyses: List[Dict]) -> List[Dict]:
+        """Score every coin at once with branchless array arithmetic.
+
+        Each boolean signal becomes a 0/1 factor, so the if-ladders collapse
+        into a few vectorized expressions over the coin axis.
+        """
+        if not analyses:
+            return []
+
+        def flags(key):
+            return np.array([a['signals'][key] for a in analyses], dtype=np.int64)
+
+        ema_aligned = flags('ema_aligned')
+        ema_cross = flags('ema_cross')
+        rsi_bullish = flags('rsi_bullish')
+        volume_surge = flags('volume_surge')
+        macd_buy = np.array([a['signals']['macd_signal'] == 'buy' for a in analyses], dtype=np.int64)
+        trend_bullish = np.array([a['signals']['trend'] == 'bullish' for a in analyses], dtype=np.int64)
+        rsi_values = np.array([a['signals']['rsi_value'] for a in analyses])
+        volume_24h = np.array([a['volume_24h'] for a in analyses])
+        atr_pct = np.array([a['indicators'].get('atr_percent', 5) for a in analyses])
+        market_cap = np.array([a['market_cap'] for a in analyses])
+
+        momentum = np.minimum(2 + 4 * ema_aligned + 2 * ema_cross + 2 * rsi_bullish, 10)
+        volume = np.minimum(4 + 3 * volume_surge + 3 * (volume_24h > 50_000_000), 10)
+        technical = np.minimum(
+            3 + 3 * macd_buy + 2 * trend_bullish + 2 * ((rsi_values >= 40) & (rsi_values <= 60)), 10
+        )
+        risk = np.maximum(0, 10 - atr_pct * 1.2)
+
+        multiplier = np.select(
+            [market_cap > 10_000_000_000, market_cap > 1_000_000_000, market_cap > 100_000_000],
+            [1.1, 1.0, 0.95],
+            default=0.0
+        )
+        final = (momentum * 0.35 + volume * 0.25 + technical * 0.25 + risk * 0.15) * multiplier
+
+        return [
+            {
+                "momentum_score": round(float(momentum[i]), 2),
+                "volume_score": round(float(volume[i]), 2),
+                "technical_score": round(float(technical[i]), 2),
+                "risk_score": round(float(risk[i]), 2),
+                "final_score": round(float(final[i]), 2)
+            }
+            for i in range(len(analyses))
+        ]
+
     def calculate_score(self, analysis: Dict) -> Dict:
-        signals = analysis['signals']
-        indicators = analysis['indicators']
-        
-        # Momentum (0-10)
-        momentum = 2
-        if signals['ema_aligned']:
-            momentum += 4
-        if signals['ema_cross']:
-            momentum += 2
-        if signals['rsi_bullish']:
-            momentum += 2
-        momentum_score = min(momentum, 10)
-        
-        # Volume (0-10)
-        volume_score = 4
-        if signals['volume_surge']:
-            volume_score += 3
-        if analysis['volume_24h'] > 50_000_000:
-            volume_score += 3
-        volume_score = min(volume_score, 10)
-        
-        # Technical (0-10)
-        technical = 3
-        if signals['macd_signal'] == 'buy':
-            technical += 3
-        if signals['trend'] == 'bullish':
-            technical += 2
-        if 40 <= signals['rsi_value'] <= 60:
-            technical += 2
-        technical_score = min(technical, 10)
-        
-        # Risk (0-10)
-        atr_pct = indicators.get('atr_percent', 5)
-        risk_score = max(0, 10 - (atr_pct * 1.2))
-        
-        final = (momentum_score * 0.35 + volume_score * 0.25 + technical_score * 0.25 + risk_score * 0.15)
-        final *= self.market_cap_multiplier(analysis['market_cap'])
-        
-        return {
-            "momentum_score": round(momentum_score, 2),
-            "volume_score": round(volume_score, 2),
-            "technical_score": round(technical_score, 2),
-            "risk_score": round(risk_score, 2),
-            "final_score": round(final, 2)
-        }
+        return self.score_all([analysis])[0]
     
     def calculate_levels(self, price: float, atr: float) -> Dict:
         # Stop loss: -2.5%
@@ -123,16 +149,17 @@ class ScoringSelector:
             "risk_reward_t1": round((target_1 - price) / risk, 2) if risk > 0 else 0
         }
     
-    def select_top_opportunities(self, technical_data: Dict) -> List[CryptoSignal]:
+    def select_top_opportunities(self, technical_data: Dict):
         logger.info("=== Starting Scoring & Selection ===")
         scored_coins = []
         
-        for analysis in technical_data['analyzed_coins']:
+        analyses = technical_data['analyzed_coins']
+        all_scores = self.score_all(analyses)
+
+        for analysis, scores in zip(analyses, all_scores):
             if analysis['market_cap'] < self.MIN_MARKET_CAP:
                 continue
-            
-            scores = self.calculate_score(analysis)
-            
+
             if scores['final_score'] < self.MIN_SCORE:
                 logger.info(f"  {analysis['symbol']}: Score {scores['final_score']:.1f} (below threshold)")
                 continue
@@ -157,7 +184,7 @@ class ScoringSelector:
                 stop_loss=levels['stop_loss'],
                 target_1=levels['target_1'],
                 target_2=levels['target_2'],
-                btc_correlation=0.75,
+                btc_correlation=analysis.get('btc_correlation', 0.75),
                 timestamp=datetime.now().isoformat()
             )
             scored_coins.append(signal)
@@ -174,9 +201,10 @@ class ScoringSelector:
             "top_opportunities": [s.to_dict() for s in top_signals]
         }
         
+        # Single JSON write, kept as a debugging artifact — callers get the
+        # dict directly instead of re-reading it from disk
         os.makedirs('data', exist_ok=True)
-        with open(self.output_file, 'w') as f:
-            json.dump(result, f, indent=2)
-        
+        dump_json(result, self.output_file)
+
         logger.info(f"✓ Selection complete. {len(top_signals)} top opportunities identified.")
-        return top_signals
+        return top_signals, result
@@ -4,96 +4,305 @@ Calculates indicators and generates signals
 """
 
 import os
-import json
+import hashlib
 import logging
+import pickle
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional
-import pandas as pd
+from typing import Dict, List, Optional
+import numpy as np
+
+from src.indicators_numba import ema_1d, ema_batch
+from src.json_utils import dump_json
 
 logger = logging.getLogger(__name__)
 
+RSI_PERIOD = 14
+
+# Memoized full-recompute results keyed on the OHLC byte content, so a rerun
+# on identical candles (e.g. manual /analyze minutes before the scheduled run)
+# costs one hash instead of every indicator. Survives across analyzer
+# instances; invalidation is automatic once new candle bytes arrive.
+_INDICATOR_CACHE = OrderedDict()
+_INDICATOR_CACHE_MAX = 256
+
+
+@dataclass
+class IndicatorState:
+    """Per-coin indicator state for one-step incremental updates"""
+    last_timestamp: str
+    ema_7: float
+    ema_25: float
+    ema_12: float
+    ema_26: float
+    macd_signal: float
+    avg_gain: float
+    avg_loss: float
+    atr: float
+
 
 class TechnicalAnalyzer:
     """Agent 2: Technical analysis and indicator calculation"""
     
     def __init__(self):
         self.output_file = "data/technical_signals.json"
-    
-    def calculate_ema(self, prices: pd.Series, period: int) -> pd.Series:
-        return prices.ewm(span=period, adjust=False).mean()
-    
-    def calculate_rsi(self, prices: pd.Series, period: int = 14) -> float:
+        self.state_file = "data/indicator_state.pkl"
+        self._states = {}
+        self._new_states = {}
+
+    def _load_states(self) -> Dict[str, IndicatorState]:
+        try:
+            with open(self.state_file, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return {}
+
+    def _save_states(self, states: Dict[str, IndicatorState]):
+        os.makedirs('data', exist_ok=True)
+        with open(self.state_file, 'wb') as f:
+            pickle.dump(states, f)
+
+    @staticmethod
+    def _ema_step(prev: float, value: float, period: int) -> float:
+        alpha = 2.0 / (period + 1)
+        return alpha * value + (1 - alpha) * prev
+
+    def incremental_update(self, state: IndicatorState, timestamp: str, close: float,
+                           high: float, low: float, prev_close: float) -> IndicatorState:
+        """Apply one new candle to the persisted state — O(1) instead of O(window)"""
+        gain = max(close - prev_close, 0.0)
+        loss = max(prev_close - close, 0.0)
+        tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+        ema_12 = self._ema_step(state.ema_12, close, 12)
+        ema_26 = self._ema_step(state.ema_26, close, 26)
+        return IndicatorState(
+            last_timestamp=timestamp,
+            ema_7=self._ema_step(state.ema_7, close, 7),
+            ema_25=self._ema_step(state.ema_25, close, 25),
+            ema_12=ema_12,
+            ema_26=ema_26,
+            macd_signal=self._ema_step(state.macd_signal, ema_12 - ema_26, 9),
+            avg_gain=(state.avg_gain * (RSI_PERIOD - 1) + gain) / RSI_PERIOD,
+            avg_loss=(state.avg_loss * (RSI_PERIOD - 1) + loss) / RSI_PERIOD,
+            atr=(state.atr * (RSI_PERIOD - 1) + tr) / RSI_PERIOD
+        )
+
+    def calculate_ema(self, prices: np.ndarray, period: int) -> np.ndarray:
+        return ema_1d(prices, period)
+
+    def ema_matrix(self, closes: np.ndarray, period: int) -> np.ndarray:
+        """EMA for a (n_coins, n_candles) matrix"""
+        return ema_batch(closes, period)
+
+    @staticmethod
+    def _avg_gain_loss(prices: np.ndarray, period: int = RSI_PERIOD):
+        delta = np.diff(prices)
+        gains = np.where(delta > 0, delta, 0.0)
+        losses = np.where(delta < 0, -delta, 0.0)
+        return float(gains[-period:].mean()), float(losses[-period:].mean())
+
+    @staticmethod
+    def _rsi_from_averages(avg_gain: float, avg_loss: float) -> float:
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else 50.0
+        rs = avg_gain / avg_loss
+        return float(100 - (100 / (1 + rs)))
+
+    def calculate_rsi(self, prices: np.ndarray, period: int = RSI_PERIOD) -> float:
         if len(prices) < period + 1:
             return 50.0
-        delta = prices.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        last_rsi = rsi.iloc[-1]
-        return float(last_rsi) if pd.notna(last_rsi) else 50.0
-    
-    def calculate_macd(self, prices: pd.Series) -> Dict:
+        avg_gain, avg_loss = self._avg_gain_loss(prices, period)
+        return self._rsi_from_averages(avg_gain, avg_loss)
+
+    def calculate_macd(self, prices: np.ndarray) -> Dict:
         if len(prices) < 26:
             return {"macd": 0, "signal": 0, "histogram": 0, "bullish": False}
-        ema_12 = self.calculate_ema(prices, 12)
-        ema_26 = self.calculate_ema(prices, 26)
-        macd_line = ema_12 - ema_26
-        signal_line = macd_line.ewm(span=9, adjust=False).mean()
-        histogram = macd_line - signal_line
+        macd_line = self.calculate_ema(prices, 12) - self.calculate_ema(prices, 26)
+        signal_line = self.calculate_ema(macd_line, 9)
+        histogram = macd_line[-1] - signal_line[-1]
         return {
-            "macd": float(macd_line.iloc[-1]) if pd.notna(macd_line.iloc[-1]) else 0,
-            "signal": float(signal_line.iloc[-1]) if pd.notna(signal_line.iloc[-1]) else 0,
-            "histogram": float(histogram.iloc[-1]) if pd.notna(histogram.iloc[-1]) else 0,
-            "bullish": float(histogram.iloc[-1]) > 0 if pd.notna(histogram.iloc[-1]) else False
+            "macd": float(macd_line[-1]),
+            "signal": float(signal_line[-1]),
+            "histogram": float(histogram),
+            "bullish": float(histogram) > 0
         }
     
-    def calculate_atr(self, df: pd.DataFrame, period: int = 14) -> float:
-        if len(df) < period + 1:
+    def calculate_atr(self, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                      period: int = 14) -> float:
+        if len(close) < period + 1:
             return 0.0
-        high = df['high']
-        low = df['low']
-        close = df['close'].shift(1)
-        tr1 = high - low
-        tr2 = abs(high - close)
-        tr3 = abs(low - close)
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-        atr = tr.rolling(window=period).mean()
-        last_atr = atr.iloc[-1]
-        return float(last_atr) if pd.notna(last_atr) else 0.0
+        c_prev = np.empty_like(close)
+        c_prev[0] = close[0]
+        c_prev[1:] = close[:-1]
+        tr = np.maximum.reduce([high - low, np.abs(high - c_prev), np.abs(low - c_prev)])
+        return float(tr[-period:].mean())
     
-    def detect_trend(self, prices: pd.Series) -> Dict:
+    def detect_trend(self, prices: np.ndarray) -> Dict:
         if len(prices) < 10:
             return {"trend": "neutral", "strength": 0}
-        recent = prices.iloc[-10:]
-        change_pct = ((recent.iloc[-1] - recent.iloc[0]) / recent.iloc[0]) * 100
+        recent = prices[-10:]
+        change_pct = float((recent[-1] - recent[0]) / recent[0]) * 100
         if change_pct > 3:
             return {"trend": "bullish", "strength": min(abs(change_pct) / 5, 5)}
         elif change_pct < -3:
             return {"trend": "bearish", "strength": min(abs(change_pct) / 5, 5)}
         return {"trend": "neutral", "strength": 0}
     
-    def analyze_coin(self, coin_data: Dict) -> Optional[Dict]:
+    @staticmethod
+    def _ohlc_arrays(coin_data: Dict):
+        """Return (close, high, low) arrays, preferring the columnar layout"""
+        arrays = coin_data.get('ohlc_arrays')
+        if arrays is not None:
+            return (np.asarray(arrays['close'], dtype=np.float32),
+                    np.asarray(arrays['high'], dtype=np.float32),
+                    np.asarray(arrays['low'], dtype=np.float32))
+        ohlc_data = coin_data.get('ohlc', [])
+        return (np.array([c['close'] for c in ohlc_data], dtype=np.float32),
+                np.array([c['high'] for c in ohlc_data], dtype=np.float32),
+                np.array([c['low'] for c in ohlc_data], dtype=np.float32))
+
+    @staticmethod
+    def _cache_key(close: np.ndarray, high: np.ndarray, low: np.ndarray) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(close.tobytes())
+        h.update(high.tobytes())
+        h.update(low.tobytes())
+        return h.digest()
+
+    def _can_increment(self, coin_data: Dict) -> bool:
+        """True when persisted state covers everything but the newest candle"""
+        state = self._states.get(coin_data.get('id'))
+        ohlc = coin_data.get('ohlc', [])
+        return (state is not None and len(ohlc) >= 2
+                and state.last_timestamp == ohlc[-2].get('timestamp'))
+
+    def batch_indicators(self, coins: List[Dict]) -> Dict[str, Dict]:
+        """Compute EMA/MACD for all coins at once on stacked close matrices.
+
+        Coins are grouped by series length so each group stacks into one
+        contiguous (n_coins, n_candles) matrix; results are identical to the
+        per-coin recurrences.
+        """
+        by_length = {}
+        for coin in coins:
+            ohlc = coin.get('ohlc', [])
+            if not ohlc or len(ohlc) < 20 or self._can_increment(coin):
+                continue
+            if self._cache_key(*self._ohlc_arrays(coin)) in _INDICATOR_CACHE:
+                continue  # analyze_coin will reuse the memoized result
+            by_length.setdefault(len(ohlc), []).append(coin)
+
+        batch = {}
+        for length, group in by_length.items():
+            closes = np.stack([self._ohlc_arrays(coin)[0] for coin in group])
+            ema_7 = self.ema_matrix(closes, 7)[:, -1]
+            ema_25 = self.ema_matrix(closes, 25)[:, -1]
+
+            if length >= 26:
+                macd_line = self.ema_matrix(closes, 12) - self.ema_matrix(closes, 26)
+                signal_line = self.ema_matrix(macd_line, 9)
+                histogram = macd_line[:, -1] - signal_line[:, -1]
+                macds = [
+                    {
+                        "macd": float(macd_line[i, -1]),
+                        "signal": float(signal_line[i, -1]),
+                        "histogram": float(histogram[i]),
+                        "bullish": float(histogram[i]) > 0
+                    }
+                    for i in range(len(group))
+                ]
+            else:
+                macds = [{"macd": 0, "signal": 0, "histogram": 0, "bullish": False}] * len(group)
+
+            for i, coin in enumerate(group):
+                batch[coin['id']] = {
+                    "ema_7": float(ema_7[i]),
+                    "ema_25": float(ema_25[i]),
+                    "macd": macds[i]
+                }
+        return batch
+
+    def analyze_coin(self, coin_data: Dict, precomputed: Optional[Dict] = None) -> Optional[Dict]:
         try:
             ohlc_data = coin_data.get('ohlc', [])
             if not ohlc_data or len(ohlc_data) < 20:
                 return None
             
-            df = pd.DataFrame(ohlc_data)
-            for col in ['close', 'high', 'low', 'open']:
-                df[col] = df[col].astype(float)
-            
-            prices = df['close']
-            ema_7 = self.calculate_ema(prices, 7)
-            ema_25 = self.calculate_ema(prices, 25)
-            rsi = self.calculate_rsi(prices, 14)
-            macd = self.calculate_macd(prices)
-            atr = self.calculate_atr(df, 14)
-            trend = self.detect_trend(prices)
-            
+            # Every indicator works on the raw arrays
+            close, high, low = self._ohlc_arrays(coin_data)
+
+            coin_id = coin_data.get('id')
+            state = self._states.get(coin_id)
+            last = ohlc_data[-1]
+
+            if self._can_increment(coin_data):
+                # Only the newest candle is new — O(1) update from persisted state
+                state = self.incremental_update(
+                    state, last.get('timestamp', ''), float(last['close']),
+                    float(last['high']), float(last['low']), float(ohlc_data[-2]['close'])
+                )
+                current_ema_7 = state.ema_7
+                current_ema_25 = state.ema_25
+                macd_line = state.ema_12 - state.ema_26
+                histogram = macd_line - state.macd_signal
+                macd = {
+                    "macd": macd_line,
+                    "signal": state.macd_signal,
+                    "histogram": histogram,
+                    "bullish": histogram > 0
+                }
+                rsi = self._rsi_from_averages(state.avg_gain, state.avg_loss)
+                atr = state.atr
+            else:
+                cache_key = self._cache_key(close, high, low)
+                cached = _INDICATOR_CACHE.get(cache_key)
+                if cached is not None:
+                    current_ema_7 = cached['ema_7']
+                    current_ema_25 = cached['ema_25']
+                    macd = cached['macd']
+                    rsi = cached['rsi']
+                    atr = cached['atr']
+                    state = cached['state']
+                else:
+                    if precomputed:
+                        current_ema_7 = precomputed['ema_7']
+                        current_ema_25 = precomputed['ema_25']
+                        macd = precomputed['macd']
+                    else:
+                        current_ema_7 = float(self.calculate_ema(close, 7)[-1])
+                        current_ema_25 = float(self.calculate_ema(close, 25)[-1])
+                        macd = self.calculate_macd(close)
+
+                    rsi = self.calculate_rsi(close)
+                    atr = self.calculate_atr(high, low, close, 14)
+
+                    avg_gain, avg_loss = self._avg_gain_loss(close)
+                    state = IndicatorState(
+                        last_timestamp=last.get('timestamp', ''),
+                        ema_7=current_ema_7,
+                        ema_25=current_ema_25,
+                        ema_12=float(ema_1d(close, 12)[-1]),
+                        ema_26=float(ema_1d(close, 26)[-1]),
+                        macd_signal=macd['signal'],
+                        avg_gain=avg_gain,
+                        avg_loss=avg_loss,
+                        atr=atr
+                    )
+
+                    _INDICATOR_CACHE[cache_key] = {
+                        'ema_7': current_ema_7, 'ema_25': current_ema_25,
+                        'macd': macd, 'rsi': rsi, 'atr': atr, 'state': state
+                    }
+                    while len(_INDICATOR_CACHE) > _INDICATOR_CACHE_MAX:
+                        _INDICATOR_CACHE.popitem(last=False)
+
+            if coin_id:
+                self._new_states[coin_id] = state
+
+            trend = self.detect_trend(close)
             current_price = coin_data['current_price']
-            current_ema_7 = float(ema_7.iloc[-1]) if pd.notna(ema_7.iloc[-1]) else current_price
-            current_ema_25 = float(ema_25.iloc[-1]) if pd.notna(ema_25.iloc[-1]) else current_price
             
             volume_24h = coin_data.get('total_volume', 0)
             
@@ -131,13 +340,37 @@ class TechnicalAnalyzer:
             logger.error(f"Error analyzing {coin_data.get('symbol', 'UNKNOWN')}: {e}")
             return None
     
+    def _attach_btc_correlation(self, analyzed_coins: List[Dict], closes_by_symbol: Dict):
+        """Correlate every coin's log returns with BTC's in one corrcoef call"""
+        if 'BTC' not in closes_by_symbol or len(closes_by_symbol) < 2:
+            return
+        n = min(len(c) for c in closes_by_symbol.values())
+        if n < 3:
+            return
+
+        symbols = [a['symbol'] for a in analyzed_coins]
+        matrix = np.stack([closes_by_symbol[s][-n:] for s in symbols]).astype(np.float64)
+        returns = np.diff(np.log(matrix), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.corrcoef(returns)[symbols.index('BTC')]
+
+        for analysis, value in zip(analyzed_coins, corr):
+            analysis['btc_correlation'] = round(float(value), 3) if np.isfinite(value) else 0.0
+
     def analyze_all(self, crypto_data: Dict) -> Dict:
         logger.info("=== Starting Technical Analysis ===")
+        self._states = self._load_states()
+        self._new_states = {}
+        batch = self.batch_indicators(crypto_data['coins'])
         analyzed_coins = []
+        closes_by_symbol = {}
         for coin_data in crypto_data['coins']:
-            analysis = self.analyze_coin(coin_data)
+            analysis = self.analyze_coin(coin_data, batch.get(coin_data.get('id')))
             if analysis:
                 analyzed_coins.append(analysis)
+                closes_by_symbol[analysis['symbol']] = self._ohlc_arrays(coin_data)[0]
+
+        self._attach_btc_correlation(analyzed_coins, closes_by_symbol)
         
         result = {
             "timestamp": datetime.now().isoformat(),
@@ -146,8 +379,9 @@ class TechnicalAnalyzer:
         }
         
         os.makedirs('data', exist_ok=True)
-        with open(self.output_file, 'w') as f:
-            json.dump(result, f, indent=2)
-        
+        dump_json(result, self.output_file)
+
+        self._save_states(self._new_states)
+
         logger.info(f"✓ Technical analysis complete. {len(analyzed_coins)} coins analyzed.")
         return result
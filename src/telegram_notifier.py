@@ -4,54 +4,370 @@ Sends trading signals and alerts via Telegram
 """
 
 import os
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict
+import queue
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.json_utils import dumps_bytes
+
+# Optional: HTTP/2 multiplexes the batched report sends over a single TLS
+# connection; without it the aiohttp path opens one connection per send
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Constant strings built once at import instead of per report
+_TS_FMT = '%d %b %Y, %H:%M'
+_SEP28 = "━" * 28
+_TOP_HEADER = f"{_SEP28}\n🏆 *TOP OPORTUNIDADES*\n{_SEP28}"
+_NO_SIGNALS_MSG = ("⚠️ *No se encontraron oportunidades* que cumplan los criterios "
+                   "de scoring esta semana.\n\nEl mercado puede estar en fase lateral "
+                   "o sin señales claras.")
+
+_HEADER_TMPL = """
+🪙 *CRYPTO SWING TRADING*
+📅 {ts} CET
+
+{sep}
+📊 *CONTEXTO DE MERCADO*
+{sep}
+🔸 BTC Dominance: {btc:.1f}%
+💰 Total Market Cap: {mcap}
+✅ {qualified} cryptos calificadas de {analyzed} analizadas
+""".format
+
+# Built once at import; format_signal_telegram runs per signal.
+# %-interpolation on a fixed-arity tuple beats re-running the many
+# FORMAT_VALUE ops of the equivalent f-string; prices arrive
+# pre-formatted because %-style has no thousands separator.
+_SIGNAL_TMPL = """
+%s *%s* (%s)
+━━━━━━━━━━━━━━━━━━━━
+📊 Score: *%.1f/10*
+💰 Precio: $%s
+📈 Cap: %s
+
+🎯 Entry: $%s - $%s
+🛑 Stop: $%s (-%.1f%%)
+💎 T1: $%s (+%.1f%%)
+💎 T2: $%s (+%.1f%%)
+
+✅ Señales: %s
+"""
+
 
 class TelegramNotifier:
     """Send notifications via Telegram"""
-    
+
+    HIGH_SCORE_THRESHOLD = 8.5
+    _MEDALS = ("🥇", "🥈", "🥉")
+
     def __init__(self):
         self.token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.chat_id = os.getenv('TELEGRAM_CHAT_ID')
-    
+        # TELEGRAM_CHAT_IDS (comma-separated) broadcasts to several chats;
+        # the single TELEGRAM_CHAT_ID remains the common case
+        raw_ids = os.getenv('TELEGRAM_CHAT_IDS') or os.getenv('TELEGRAM_CHAT_ID') or ''
+        self.chat_ids = [c.strip() for c in raw_ids.split(',') if c.strip()]
+        self.chat_id = self.chat_ids[0] if self.chat_ids else None
+        self.enabled = bool(self.token and self.chat_id)
+        # Hot-path constants: URL and the fixed part of every payload
+        self._send_url = f"https://api.telegram.org/bot{self.token}/sendMessage" if self.token else None
+        self._copy_url = f"https://api.telegram.org/bot{self.token}/copyMessage" if self.token else None
+        self._payload_base = {"chat_id": self.chat_id, "disable_web_page_preview": True}
+        self._json_headers = {"Content-Type": "application/json"}
+        # Persistent session: reports send 5+ messages back to back, and
+        # keep-alive saves a TCP+TLS handshake on each one
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        # Pace sends below Telegram's ~30 msg/s bot limit; one 429 can
+        # flood-block the bot for seconds to hours
+        self._last_send = 0.0
+        self._min_interval = 1.0 / 25
+        # Alerts go through a background queue so the analysis path never
+        # blocks on a Telegram round-trip; the worker thread starts lazily
+        # on the first enqueue so idle notifiers don't leak threads
+        self._q = queue.Queue()
+        self._worker = None
+
+    def _ensure_worker(self):
+        """Start (or restart) the alert worker thread on demand"""
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._drain, daemon=True)
+            self._worker.start()
+
+    def _drain(self):
+        """Worker loop: send queued alert messages over the shared session"""
+        while True:
+            text = self._q.get()
+            try:
+                if text is None:  # shutdown sentinel from close()
+                    return
+                self.send_message(text)
+            except Exception as e:
+                # Never let one bad send kill the worker — queued alerts
+                # would pile up forever behind a dead thread
+                logger.error(f"❌ Alert worker error: {e}")
+            finally:
+                self._q.task_done()
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (bounded) for queued alerts to be sent before shutdown"""
+        deadline = time.monotonic() + timeout
+        while self._q.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def close(self):
+        """Stop the alert worker and release the HTTP connection pool"""
+        if self._worker is not None and self._worker.is_alive():
+            self._q.put(None)
+            self._worker.join(timeout=5)
+        self._session.close()
+
     def send_message(self, text: str, parse_mode: str = "Markdown"):
         """Send a message to Telegram"""
-        if not self.token or not self.chat_id:
+        if not self.enabled:
             logger.warning("⚠️ Telegram credentials not configured")
             return False
-        
-        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
-        data = {
+
+        # orjson (when installed) encodes the emoji-heavy text much faster
+        # than the stdlib encoder requests would use via json=
+        body = dumps_bytes({**self._payload_base, "text": text, "parse_mode": parse_mode})
+
+        # Token-bucket pacing: wait out the remainder of the send interval
+        sleep_for = self._min_interval - (time.monotonic() - self._last_send)
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+
+        # Bounded retry: network errors and 5xx are transient (exponential
+        # backoff with jitter), 429 honors the server's retry_after, any
+        # other 4xx is permanent and fails immediately
+        for attempt in range(3):
+            try:
+                response = self._session.post(self._send_url, data=body,
+                                              headers=self._json_headers, timeout=10)
+                self._last_send = time.monotonic()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == 2:
+                    logger.error(f"❌ Error sending Telegram message: {e}")
+                    return False
+                backoff = 0.5 * 2 ** attempt + random.random() * 0.1
+                logger.warning(f"⚠️ Network error sending Telegram message, retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+                continue
+
+            status = response.status_code
+            if status == 429:
+                try:
+                    retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    # Proxies/CDNs can answer 429 with a non-JSON body
+                    retry_after = 1
+                logger.warning(f"⚠️ Telegram flood limit hit, retrying in {retry_after}s")
+                time.sleep(retry_after)
+                continue
+            if 500 <= status < 600:
+                if attempt == 2:
+                    logger.error(f"❌ Telegram API error {status}")
+                    return False
+                backoff = 0.5 * 2 ** attempt + random.random() * 0.1
+                logger.warning(f"⚠️ Telegram API {status}, retrying in {backoff:.1f}s")
+                time.sleep(backoff)
+                continue
+            if status >= 400:
+                logger.error(f"❌ Telegram API error {status}: {response.text}")
+                return False
+
+            logger.info("✓ Telegram notification sent")
+            if len(self.chat_ids) > 1:
+                self._broadcast_copy(response)
+            return True
+
+        logger.error("❌ Telegram message not sent after retries")
+        return False
+
+    def _broadcast_copy(self, response):
+        """Fan the just-sent message out to the extra chats via copyMessage.
+
+        copyMessage references the original by id — a ~50-byte payload per
+        chat instead of re-sending (and re-parsing) the full text.
+        """
+        try:
+            message_id = response.json()["result"]["message_id"]
+        except Exception:
+            logger.warning("⚠️ No message_id in response, skipping broadcast copies")
+            return
+        for chat_id in self.chat_ids[1:]:
+            body = dumps_bytes({
+                "chat_id": chat_id,
+                "from_chat_id": self.chat_id,
+                "message_id": message_id
+            })
+            try:
+                self._session.post(self._copy_url, data=body,
+                                   headers=self._json_headers, timeout=10)
+            except Exception as e:
+                logger.error(f"❌ Error copying message to chat {chat_id}: {e}")
+    
+    def build_webhook_reply(self, text: str, parse_mode: str = "Markdown") -> Dict:
+        """Build a sendMessage payload to return from a webhook handler.
+
+        Telegram executes the method embedded in the webhook HTTP response,
+        so a Flask route can `return jsonify(notifier.build_webhook_reply(msg))`
+        and skip the outbound POST (and its TLS round-trip) entirely.
+        """
+        return {
+            "method": "sendMessage",
             "chat_id": self.chat_id,
             "text": text,
             "parse_mode": parse_mode,
             "disable_web_page_preview": True
         }
-        
-        try:
-            response = requests.post(url, json=data, timeout=10)
-            response.raise_for_status()
+
+    async def _retry_async(self, attempt_fn) -> bool:
+        """Shared retry policy for the async senders — mirrors send_message:
+        network errors and 5xx back off exponentially, 429 honors the
+        server's retry_after, other 4xx fail immediately"""
+        for attempt in range(3):
+            try:
+                status, payload = await attempt_fn()
+            except Exception as e:
+                if attempt == 2:
+                    logger.error(f"❌ Error sending Telegram message: {e}")
+                    return False
+                backoff = 0.5 * 2 ** attempt + random.random() * 0.1
+                logger.warning(f"⚠️ Network error sending Telegram message, retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+                continue
+
+            if status == 429:
+                retry_after = 1
+                if isinstance(payload, dict):
+                    retry_after = payload.get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"⚠️ Telegram flood limit hit, retrying in {retry_after}s")
+                await asyncio.sleep(retry_after)
+                continue
+            if 500 <= status < 600:
+                if attempt == 2:
+                    logger.error(f"❌ Telegram API error {status}")
+                    return False
+                backoff = 0.5 * 2 ** attempt + random.random() * 0.1
+                logger.warning(f"⚠️ Telegram API {status}, retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+                continue
+            if status >= 400:
+                logger.error(f"❌ Telegram API error {status}")
+                return False
+
             logger.info("✓ Telegram notification sent")
             return True
-        except Exception as e:
-            logger.error(f"❌ Error sending Telegram message: {e}")
-            return False
-    
+
+        logger.error("❌ Telegram message not sent after retries")
+        return False
+
+    async def send_message_async(self, session: aiohttp.ClientSession, text: str,
+                                 parse_mode: str = "Markdown") -> bool:
+        """Send one message over a shared aiohttp session"""
+        data = {**self._payload_base, "text": text, "parse_mode": parse_mode}
+
+        async def attempt():
+            async with session.post(self._send_url, json=data,
+                                    timeout=aiohttp.ClientTimeout(total=10)) as response:
+                payload = None
+                if response.status == 429:
+                    try:
+                        payload = await response.json()
+                    except Exception:
+                        payload = None
+                return response.status, payload
+
+        return await self._retry_async(attempt)
+
+    async def _send_httpx(self, client, text: str, parse_mode: str = "Markdown") -> bool:
+        """Send one message over a shared HTTP/2 client"""
+        data = {**self._payload_base, "text": text, "parse_mode": parse_mode}
+
+        async def attempt():
+            response = await client.post(self._send_url, json=data)
+            payload = None
+            if response.status_code == 429:
+                try:
+                    payload = response.json()
+                except Exception:
+                    payload = None
+            return response.status_code, payload
+
+        return await self._retry_async(attempt)
+
+    async def _paced(self, index: int, send_coro):
+        """Stagger a gathered send so the burst stays under the msg/s budget"""
+        await asyncio.sleep(index * self._min_interval)
+        return await send_coro
+
+    async def _send_all_async(self, messages: List[str]):
+        """Send the header first (ordering), then the rest concurrently"""
+        if HTTPX_AVAILABLE:
+            # All sends share one multiplexed HTTP/2 connection — no
+            # head-of-line blocking between the gathered POSTs
+            async with httpx.AsyncClient(http2=True, timeout=10) as client:
+                await self._send_httpx(client, messages[0])
+                if len(messages) > 1:
+                    await asyncio.gather(*[
+                        self._paced(i, self._send_httpx(client, m))
+                        for i, m in enumerate(messages[1:], 1)
+                    ])
+            return
+
+        async with aiohttp.ClientSession() as session:
+            await self.send_message_async(session, messages[0])
+            if len(messages) > 1:
+                await asyncio.gather(*[
+                    self._paced(i, self.send_message_async(session, m))
+                    for i, m in enumerate(messages[1:], 1)
+                ])
+
+    def send_messages(self, messages: List[str]):
+        """Send a batch of messages, overlapping the API round-trips"""
+        if not messages:
+            return
+        if not self.enabled:
+            logger.warning("⚠️ Telegram credentials not configured")
+            return
+        if len(self.chat_ids) > 1:
+            # The copyMessage fan-out lives on the sync path; multi-chat
+            # setups take it so every chat receives the full report
+            for message in messages:
+                self.send_message(message)
+            return
+        asyncio.run(self._send_all_async(messages))
+
     def format_mcap(self, mcap: float) -> str:
         """Format market cap"""
-        if mcap >= 1_000_000_000:
-            return f"${mcap/1_000_000_000:.1f}B"
+        # Bucket to whole millions so repeated caps hit the cache
+        return self._format_mcap_cached(int(mcap // 1_000_000))
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _format_mcap_cached(mcap_millions: int) -> str:
+        if mcap_millions >= 1_000:
+            return f"${mcap_millions/1_000:.1f}B"
         else:
-            return f"${mcap/1_000_000:.0f}M"
+            return f"${mcap_millions:.0f}M"
     
     def format_signal_telegram(self, signal: Dict, rank: int) -> str:
         """Format a signal for Telegram"""
-        medal = ["🥇", "🥈", "🥉"][rank-1] if rank <= 3 else f"#{rank}"
+        medal = self._MEDALS[rank-1] if rank <= 3 else f"#{rank}"
         
         entry_low, entry_high = signal['entry_zone']
         price = signal['price']
@@ -59,76 +375,113 @@ class TelegramNotifier:
         target_1 = signal['target_1']
         target_2 = signal['target_2']
         
-        risk_pct = ((price - stop_loss) / price * 100)
-        reward_pct_t1 = ((target_1 - price) / price * 100)
-        reward_pct_t2 = ((target_2 - price) / price * 100)
-        
-        # Format signals
+        # One division; the three percentages are multiplies off it
+        inv = 100.0 / price
+        risk_pct = (price - stop_loss) * inv
+        reward_pct_t1 = (target_1 - price) * inv
+        reward_pct_t2 = (target_2 - price) * inv
+
+        # Format signals — one local lookup for the nested dict
+        get = signal['signals'].get
         signals_list = []
-        if signal['signals'].get('ema_aligned'):
+        if get('ema_aligned'):
             signals_list.append("EMA✓")
-        if signal['signals'].get('rsi_bullish'):
-            signals_list.append(f"RSI{signal['signals'].get('rsi_value', 0):.0f}")
-        if signal['signals'].get('macd_signal') == 'buy':
+        if get('rsi_bullish'):
+            signals_list.append(f"RSI{get('rsi_value', 0):.0f}")
+        if get('macd_signal') == 'buy':
             signals_list.append("MACD✓")
-        if signal['signals'].get('volume_surge'):
+        if get('volume_surge'):
             signals_list.append("Vol✓")
-        
-        signals_str = " | ".join(signals_list[:4]) if signals_list else "N/A"
-        
-        return f"""
-{medal} *{signal['symbol']}* ({signal['name']})
-━━━━━━━━━━━━━━━━━━━━
-📊 Score: *{signal['final_score']:.1f}/10*
-💰 Precio: ${price:,.4f}
-📈 Cap: {self.format_mcap(signal['market_cap'])}
 
-🎯 Entry: ${entry_low:,.4f} - ${entry_high:,.4f}
-🛑 Stop: ${stop_loss:,.4f} (-{risk_pct:.1f}%)
-💎 T1: ${target_1:,.4f} (+{reward_pct_t1:.1f}%)
-💎 T2: ${target_2:,.4f} (+{reward_pct_t2:.1f}%)
+        signals_str = " | ".join(signals_list[:4]) if signals_list else "N/A"
 
-✅ Señales: {signals_str}
-"""
+        return _SIGNAL_TMPL % (
+            medal,
+            signal['symbol'],
+            signal['name'],
+            signal['final_score'],
+            f"{price:,.4f}",
+            self.format_mcap(signal['market_cap']),
+            f"{entry_low:,.4f}",
+            f"{entry_high:,.4f}",
+            f"{stop_loss:,.4f}",
+            risk_pct,
+            f"{target_1:,.4f}",
+            reward_pct_t1,
+            f"{target_2:,.4f}",
+            reward_pct_t2,
+            signals_str
+        )
     
     def send_analysis_report(self, data: Dict):
         """Send complete analysis report via Telegram"""
+        if not self.enabled:
+            logger.warning("⚠️ Telegram credentials not configured")
+            return
+
         signals = data.get('top_opportunities', [])
         market_ctx = data.get('market_context', {})
         
         # Header
-        header = f"""
-🪙 *CRYPTO SWING TRADING*
-📅 {datetime.now().strftime('%d %b %Y, %H:%M')} CET
+        header = _HEADER_TMPL(
+            ts=time.strftime(_TS_FMT),
+            sep=_SEP28,
+            btc=market_ctx.get('btc_dominance', 0),
+            mcap=self.format_mcap(market_ctx.get('total_market_cap', 0)),
+            qualified=data.get('total_qualified', 0),
+            analyzed=data.get('total_analyzed', 0)
+        )
+        # Phase 1: format everything (pure CPU); phase 2: send the batch.
+        # Keeping the phases separate avoids interleaving formatting with
+        # network waits and is what makes the batched dispatch possible.
+        messages = [header]
 
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📊 *CONTEXTO DE MERCADO*
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🔸 BTC Dominance: {market_ctx.get('btc_dominance', 0):.1f}%
-💰 Total Market Cap: {self.format_mcap(market_ctx.get('total_market_cap', 0))}
-✅ {data.get('total_qualified', 0)} cryptos calificadas de {data.get('total_analyzed', 0)} analizadas
-"""
-        self.send_message(header)
-        
         if signals:
-            # Send header for opportunities
-            self.send_message("━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n🏆 *TOP OPORTUNIDADES*\n━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
-            
-            # Send top 3 signals
-            for i, signal in enumerate(signals[:3], 1):
-                msg = self.format_signal_telegram(signal, i)
-                self.send_message(msg)
-            
+            formatted = [self.format_signal_telegram(s, i) for i, s in enumerate(signals[:3], 1)]
+
+            # One message for the whole opportunities block — three formatted
+            # signals fit comfortably inside Telegram's 4096-char limit
+            parts = [_TOP_HEADER, *formatted]
+
             # Footer if more signals
             if len(signals) > 3:
-                footer = f"\n📋 +{len(signals)-3} oportunidades más disponibles"
-                self.send_message(footer)
+                parts.append(f"\n📋 +{len(signals)-3} oportunidades más disponibles")
+
+            messages.extend(self._pack_messages(parts))
         else:
-            self.send_message("⚠️ *No se encontraron oportunidades* que cumplan los criterios de scoring esta semana.\n\nEl mercado puede estar en fase lateral o sin señales claras.")
+            messages.append(_NO_SIGNALS_MSG)
+
+        self.send_messages(messages)
+
+    @staticmethod
+    def _pack_messages(parts: List[str], limit: int = 4096) -> List[str]:
+        """Join parts into as few messages as fit Telegram's length limit,
+        splitting only at part (signal) boundaries"""
+        packed = []
+        current = ""
+        for part in parts:
+            candidate = f"{current}\n{part}" if current else part
+            if len(candidate) > limit and current:
+                packed.append(current)
+                candidate = part
+            current = candidate
+        if current:
+            packed.append(current)
+        return packed
     
+    @classmethod
+    def filter_high_score(cls, signals, threshold: float = None):
+        """Keep only alert-worthy signals — callers loop over winners instead
+        of paying a method call per filtered-out signal"""
+        if threshold is None:
+            threshold = cls.HIGH_SCORE_THRESHOLD
+        return [s for s in signals if s.final_score >= threshold]
+
     def send_high_score_alert(self, signal):
         """Send alert for high-score signals (>=8.5)"""
-        if signal.final_score < 8.5:
+        if not self.enabled:
+            return
+        if signal.final_score < self.HIGH_SCORE_THRESHOLD:
             return
         
         price = signal.price
@@ -146,4 +499,6 @@ class TelegramNotifier:
 
 🔥 Oportunidad excepcional detectada
 """
-        self.send_message(alert)
+        # Fire-and-forget: the background worker does the HTTP round-trip
+        self._ensure_worker()
+        self._q.put(alert)
@@ -0,0 +1,33 @@
+"""
+Scheduler Worker
+Runs the scheduled analysis in its own process so long pipeline runs never
+starve the web process answering Render's health probes
+"""
+
+import logging
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
+import pytz
+
+from src.pipeline import run_crypto_analysis
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+scheduler = BlockingScheduler(timezone=pytz.timezone('Europe/Madrid'))
+
+# Todos los días a las 9:30 AM CET
+scheduler.add_job(
+    func=run_crypto_analysis,
+    trigger=CronTrigger(hour=9, minute=30, timezone='Europe/Madrid'),
+    id='daily_analysis',
+    name='Daily Crypto Analysis'
+)
+
+if __name__ == '__main__':
+    logger.info("✅ Scheduler worker started")
+    scheduler.start()